@@ -1,29 +1,78 @@
 # ai.py
 import os
+import hashlib
+import numpy as np
 import yt_dlp
-import whisper
+import ctranslate2
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functools import lru_cache
+from diskcache import Cache
+from faster_whisper import WhisperModel, BatchedInferencePipeline
 from langchain_google_genai import GoogleGenerativeAI
 from langchain.chains.summarize import load_summarize_chain
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.prompts import PromptTemplate
-import subprocess
-from typing import List, Dict, Any
+from langchain_core.documents import Document
+import shutil
+import tempfile
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+from learning_platform.webhook import encode_webhook_body
 
 # Configuración inicial
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 if GOOGLE_API_KEY:
     os.environ["GOOGLE_API_KEY"] = GOOGLE_API_KEY
 
+DOWNLOAD_WORKERS = min(8, (os.cpu_count() or 1) * 2)  # Descargas simultáneas de yt-dlp
+WHISPER_BATCH_SIZE = 16  # Segmentos de audio por lote en faster-whisper
+MAX_STUFF_CHARS = 120_000  # Transcripciones más cortas se resumen en una sola llamada
+SUMMARY_MAX_CONCURRENCY = 8  # Llamadas simultáneas a Gemini para transcripciones largas
+WHISPER_DEVICE = os.environ.get("WHISPER_DEVICE", "auto")  # auto, cuda o cpu
+WHISPER_COMPUTE_TYPE = os.environ.get("WHISPER_COMPUTE_TYPE")  # ej: float32 para desactivar INT8
+WHISPER_WORKERS = int(os.environ.get("WHISPER_WORKERS", "1"))  # Transcripciones en paralelo sobre el mismo modelo
+# Directorio de audios temporales: tmpfs (RAM) si está disponible
+AUDIO_DIR = os.environ.get("AUDIO_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+
+# Modelos compartidos por todo el proceso (se cargan una sola vez)
+_LLM = None
+_WHISPER = None
+_MODEL_LOCK = threading.Lock()
+
+# Sesión HTTP compartida (keep-alive) para los webhooks
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.2)))
+
+# Caché en disco de transcripciones y resúmenes por video_id
+TRANSCRIPT_TTL = 7 * 86400  # Los videos de YouTube no cambian para un mismo id
+SUMMARY_TTL = 86400
+_CACHE = Cache(os.environ.get("TRANSCRIPT_CACHE_DIR", "./.transcript_cache"))
+
+# Componentes del resumen (se construyen una sola vez)
+CHUNK_SIZE = 2000  # Caracteres por chunk en transcripciones largas
+MAP_PROMPT = PromptTemplate(
+    input_variables=["text"],
+    template="Resume el siguiente texto de manera concisa en español:\n\n{text}"
+)
+COMBINE_PROMPT = PromptTemplate(
+    input_variables=["text"],
+    template="Resume los siguientes textos de manera concisa en español, combinando la información de forma coherente:\n\n{text}"
+)
+PROMPT_HASH = hashlib.sha1((MAP_PROMPT.template + COMBINE_PROMPT.template).encode()).hexdigest()
+_CHAIN_CACHE: Dict[int, Any] = {}
+# Campos del resultado que recibe el webhook de n8n por cada video
+WEBHOOK_FIELDS = ("url", "title", "video_id", "summary", "transcript_length", "chunks_processed")
+_WHISPER_PIPELINE = None
+
+@lru_cache(maxsize=1)
 def check_dependencies():
-    """Verificar dependencias requeridas"""
-    try:
-        result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, check=True)
+    """Verificar dependencias requeridas (una sola vez por proceso)"""
+    if shutil.which("ffmpeg") is not None:
         print("✅ FFmpeg está disponible")
         return True
-    except (FileNotFoundError, subprocess.CalledProcessError):
-        print("❌ FFmpeg no está disponible")
-        return False
+    print("❌ FFmpeg no está disponible")
+    return False
 
 def initialize_models():
     """Inicializar modelos de IA"""
@@ -35,8 +84,18 @@ def initialize_models():
             max_tokens=200
         )
         
-        # Inicializar Whisper
-        whisper_model = whisper.load_model("base")
+        # Inicializar Whisper (CTranslate2 con pesos INT8)
+        if WHISPER_DEVICE == "auto":
+            use_cuda = ctranslate2.get_cuda_device_count() > 0
+        else:
+            use_cuda = WHISPER_DEVICE == "cuda"
+        whisper_model = WhisperModel(
+            "base",
+            device="cuda" if use_cuda else "cpu",
+            compute_type=WHISPER_COMPUTE_TYPE or ("int8_float16" if use_cuda else "int8"),
+            cpu_threads=max(1, (os.cpu_count() or 1) // WHISPER_WORKERS),
+            num_workers=WHISPER_WORKERS
+        )
         
         print("✅ Modelos inicializados correctamente")
         return llm, whisper_model
@@ -44,148 +103,252 @@ def initialize_models():
         print(f"❌ Error inicializando modelos: {e}")
         raise
 
-def process_video(youtube_url: str) -> Dict[str, Any]:
+def get_models():
+    """Obtener los modelos de IA, inicializándolos solo en el primer uso"""
+    global _LLM, _WHISPER
+    if _WHISPER is None:
+        with _MODEL_LOCK:
+            if _WHISPER is None:
+                _LLM, _WHISPER = initialize_models()
+    return _LLM, _WHISPER
+
+def warm_up_models():
+    """Cargar los modelos y transcribir un segundo de silencio para inicializar los kernels"""
+    _, whisper_model = get_models()
+    segments, _ = whisper_model.transcribe(np.zeros(16000, dtype=np.float32), beam_size=1)
+    list(segments)
+
+def get_whisper_pipeline() -> BatchedInferencePipeline:
+    """Obtener el pipeline por lotes de Whisper sobre el modelo compartido"""
+    global _WHISPER_PIPELINE
+    if _WHISPER_PIPELINE is None:
+        _, whisper_model = get_models()
+        with _MODEL_LOCK:
+            if _WHISPER_PIPELINE is None:
+                _WHISPER_PIPELINE = BatchedInferencePipeline(model=whisper_model)
+    return _WHISPER_PIPELINE
+
+def get_chain(llm):
+    """Obtener la cadena de resumen "stuff" para un LLM, construyéndola una sola vez"""
+    chain = _CHAIN_CACHE.get(id(llm))
+    if chain is None:
+        chain = load_summarize_chain(llm, chain_type="stuff", prompt=MAP_PROMPT, verbose=False)
+        _CHAIN_CACHE[id(llm)] = chain
+    return chain
+
+def download_audio(youtube_url: str) -> Dict[str, Any]:
     """
-    Procesar un video de YouTube y enviar resumen al webhook
+    Descargar el audio de un video de YouTube
 
     Args:
         youtube_url: URL de YouTube
-    
+
     Returns:
-        Dict con resultados del procesamiento
+        Dict con url, título, id del video y ruta del audio descargado
+    """
+    print(f"🎥 Descargando: {youtube_url}")
+
+    # Configurar yt-dlp
+    ydl_opts = {
+            'format': 'bestaudio/best',  # Intenta el mejor audio disponible
+            # Sin conversión a mp3: faster-whisper decodifica el audio original
+            'outtmpl': 'audio_%(id)s.%(ext)s',
+            'paths': {'home': AUDIO_DIR},
+            'quiet': True,
+            'fragment_retries': 5,  # Reintenta descargar fragmentos hasta 5 veces
+            'retry_sleep': 5,  # Espera 5 segundos entre reintentos
+            'http_chunk_size': 1048576,  # Tamaño de chunk más pequeño para conexiones lentas
+            'socket_timeout': 30,  # Aumenta el timeout a 30 segundos
+        }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(youtube_url, download=False)
+        video = {
+            "url": youtube_url,
+            "title": info.get('title', 'Unknown'),
+            "video_id": info['id'],
+            "audio_file": None,
+            "segments": _CACHE.get(f"seg:{info['id']}")
+        }
+
+        # Solo descargar si la transcripción no está en caché
+        if video["segments"] is None:
+            info = ydl.process_ie_result(info, download=True)
+            video["audio_file"] = info["requested_downloads"][0]["filepath"]
+        else:
+            print(f"♻️ Transcripción en caché: {info['id']}")
+
+    return video
+
+def chunk_segments(segments: List[str], chunk_size: int = CHUNK_SIZE) -> List[Document]:
     """
+    Agrupar segmentos de Whisper en chunks de hasta chunk_size caracteres
+
+    Los chunks respetan los límites de los segmentos y cada uno repite el
+    último segmento del anterior como solapamiento.
+    """
+    docs = []
+    buffer: List[str] = []
+    length = 0
+    for text in segments:
+        if buffer and length + len(text) > chunk_size:
+            docs.append(Document(page_content=" ".join(buffer)))
+            buffer = buffer[-1:]
+            length = len(buffer[0])
+        buffer.append(text)
+        length += len(text)
+    if buffer:
+        docs.append(Document(page_content=" ".join(buffer)))
+    return docs
+
+def summarize_transcript(segments: List[str], llm) -> Tuple[str, int]:
+    """
+    Resumir una transcripción con la menor cantidad de llamadas al LLM
+
+    Si la transcripción entra en el contexto del modelo se resume en una
+    sola llamada ("stuff"); si no, se resumen los chunks en paralelo y se
+    combinan en una llamada final.
+
+    Args:
+        segments: Textos de los segmentos de Whisper
+
+    Returns:
+        Tupla (resumen, chunks procesados)
+    """
+    transcript = " ".join(segments)
+    if len(transcript) < MAX_STUFF_CHARS:
+        summary_output = get_chain(llm).invoke({"input_documents": [Document(page_content=transcript)]})
+        return summary_output["output_text"], 1
+
+    # Dividir en chunks por segmentos y resumirlos en paralelo
+    texts = chunk_segments(segments)
+    partials = llm.batch(
+        [MAP_PROMPT.format(text=t.page_content) for t in texts],
+        config={"max_concurrency": SUMMARY_MAX_CONCURRENCY}
+    )
+    summary = llm.invoke(COMBINE_PROMPT.format(text="\n\n".join(partials)))
+    return summary, len(texts)
+
+def transcribe_video(video: Dict[str, Any]) -> Optional[List[str]]:
+    """
+    Transcribir con Whisper un audio ya descargado y borrar el archivo
+
+    Args:
+        video: Datos devueltos por download_audio
+
+    Returns:
+        Textos de los segmentos (de la caché si ya estaba transcripto),
+        o None si no hay audio
+    """
+    segment_texts = video.get("segments")
+    if segment_texts is not None:
+        return segment_texts
+
+    audio_file = video["audio_file"]
+    if not (audio_file and os.path.exists(audio_file)):
+        return None
+
     try:
-        # Verificar dependencias
-        if not check_dependencies():
-            return {"error": "FFmpeg no disponible", "success": False}
-        
-        # Inicializar modelos
-        llm, whisper_model = initialize_models()
-        
-        # Configurar text splitter
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
-        
-        # Configurar prompts
-        map_prompt = PromptTemplate(
-            input_variables=["text"],
-            template="Resume el siguiente texto de manera concisa en español:\n\n{text}"
-        )
-        combine_prompt = PromptTemplate(
-            input_variables=["text"],
-            template="Resume los siguientes textos de manera concisa en español, combinando la información de forma coherente:\n\n{text}"
-        )
-        
-        results = []
-
-        try:
-            print(f"🎥 Procesando: {youtube_url}")
-
-            # Configurar yt-dlp
-            ydl_opts = {
-                    'format': 'bestaudio/best',  # Intenta el mejor audio disponible
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                    'outtmpl': 'audio_%(id)s.%(ext)s',
-                    'quiet': True,
-                    'postprocessor_args': ['-y'],
-                    'fragment_retries': 5,  # Reintenta descargar fragmentos hasta 5 veces
-                    'retry_sleep': 5,  # Espera 5 segundos entre reintentos
-                    'http_chunk_size': 1048576,  # Tamaño de chunk más pequeño para conexiones lentas
-                    'socket_timeout': 30,  # Aumenta el timeout a 30 segundos
-                }
-                # Descargar audio
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(youtube_url, download=True)
-                video_title = info.get('title', 'Unknown')
-                video_id = info['id']
-                audio_file = f"audio_{video_id}.mp3"
-            
-            # Transcribir con Whisper
-            if os.path.exists(audio_file):
-                print(f"🎙️ Transcribiendo {audio_file}...")
-                result = whisper_model.transcribe(audio_file)
-                transcript = result["text"]
-                
-                # Dividir texto en chunks
-                texts = text_splitter.create_documents([transcript])
-                
-                # Generar resumen
-                if texts:
-                    chain = load_summarize_chain(
-                        llm,
-                        chain_type="map_reduce",
-                        map_prompt=map_prompt,
-                        combine_prompt=combine_prompt,
-                        verbose=False
-                    )
-                    
-                    summary_output = chain.invoke({"input_documents": texts})
-                    summary = summary_output["output_text"]
-                    
-                    # Preparar datos para webhook
-                    video_data = {
-                        "url": youtube_url,
-                        "title": video_title,
-                        "video_id": video_id,
-                        "summary": summary,
-                        "transcript_length": len(transcript),
-                        "chunks_processed": len(texts)
-                    }
-                    
-                    # Enviar al webhook de n8n
-                    webhook_response = send_to_webhook(video_data)
-                    
-                    results.append({
-                        "url": youtube_url,
-                        "title": video_title,
-                        "summary": summary,
-                        "webhook_status": webhook_response.get("status", "error"),
-                        "success": True
-                    })
-                    
-                    print(f"✅ Procesado: {video_title}")
-                
-                # Limpiar archivo temporal
-                if os.path.exists(audio_file):
-                    os.remove(audio_file)
-                    
-            else:
-                results.append({
-                    "url": youtube_url,
-                    "error": "No se pudo descargar el audio",
-                    "success": False
-                })
-                    
-        except Exception as e:
-            print(f"❌ Error procesando {youtube_url}: {e}")
-            results.append({
-                "url": youtube_url,
-                "error": str(e),
-                "success": False
-            })
-        
+        print(f"🎙️ Transcribiendo {audio_file}...")
+        segments, _ = get_whisper_pipeline().transcribe(audio_file, batch_size=WHISPER_BATCH_SIZE, beam_size=1)
+        segment_texts = [segment.text.strip() for segment in segments if segment.text.strip()]
+        _CACHE.set(f"seg:{video['video_id']}", segment_texts, expire=TRANSCRIPT_TTL)
+        return segment_texts
+    finally:
+        # Limpiar archivo temporal
+        if os.path.exists(audio_file):
+            os.remove(audio_file)
+
+def summarize_transcription(video: Dict[str, Any], segment_texts: Optional[List[str]]) -> Dict[str, Any]:
+    """
+    Resumir la transcripción de un video y enviar el resumen al webhook
+
+    Args:
+        video: Datos devueltos por download_audio
+        segment_texts: Transcripción devuelta por transcribe_video
+
+    Returns:
+        Dict con el resultado del video
+    """
+    youtube_url = video["url"]
+    video_id = video["video_id"]
+
+    if segment_texts is None:
         return {
-            "success": True,
-            "processed_videos": len(results),
-            "successful_videos": len([r for r in results if r.get("success", False)]),
-            "results": results
+            "url": youtube_url,
+            "error": "No se pudo descargar el audio",
+            "success": False
         }
-        
-    except Exception as e:
+
+    # Generar resumen
+    if not segment_texts:
         return {
-            "success": False,
-            "error": str(e),
-            "results": []
+            "url": youtube_url,
+            "error": "Transcripción vacía",
+            "success": False
         }
 
-def process_youtube_video(url: str) -> Dict[str, Any]:
-    print(f"🟢 Entrando a process_youtube_video con url: {url}")
-    summary = process_video(url)
-    # Lógica para enviar resúmenes al webhook (puedes usar requests.post)
-    return summary
+    summary_key = f"sum:{video_id}:{PROMPT_HASH}"
+    cached = _CACHE.get(summary_key)
+
+    if cached is None:
+        llm, _ = get_models()
+        summary, chunks_processed = summarize_transcript(segment_texts, llm)
+        _CACHE.set(summary_key, {"summary": summary, "chunks": chunks_processed}, expire=SUMMARY_TTL)
+    else:
+        summary, chunks_processed = cached["summary"], cached["chunks"]
+
+    # Preparar datos para webhook
+    video_data = {
+        "url": youtube_url,
+        "title": video["title"],
+        "video_id": video_id,
+        "summary": summary,
+        "transcript_length": len(" ".join(segment_texts)),
+        "chunks_processed": chunks_processed
+    }
+
+    # Enviar al webhook de n8n
+    webhook_response = send_to_webhook(video_data)
+
+    print(f"✅ Procesado: {video['title']}")
+    return {
+        **video_data,
+        "webhook_status": webhook_response.get("status", "error"),
+        "success": True
+    }
+
+def resend_result(result: Dict[str, Any], youtube_url: str) -> Dict[str, Any]:
+    """
+    Enviar al webhook de n8n un resultado ya procesado (caché de resultados)
+
+    Args:
+        result: Resultado guardado de summarize_transcription
+        youtube_url: URL con la que se pidió el video ahora (la caché es por video_id)
+
+    Returns:
+        El resultado con la URL actual y el estado del nuevo envío
+    """
+    video_data = {key: result.get(key) for key in WEBHOOK_FIELDS}
+    video_data["url"] = youtube_url
+    webhook_response = send_to_webhook(video_data)
+    return {
+        **result,
+        "url": youtube_url,
+        "webhook_status": webhook_response.get("status", "error"),
+        "cached": True
+    }
+
+def transcribe_and_summarize(video: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Transcribir y resumir un audio ya descargado con los modelos compartidos
+
+    Args:
+        video: Datos devueltos por download_audio
+
+    Returns:
+        Dict con el resultado del video
+    """
+    return summarize_transcription(video, transcribe_video(video))
 
 def send_to_webhook(data: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -199,10 +362,11 @@ def send_to_webhook(data: Dict[str, Any]) -> Dict[str, Any]:
     """
     webhook_url = "https://pardinian.app.n8n.cloud/webhook-test/09484a9c-bccb-4344-8f11-957aed42daef"
     try:
-        response = requests.post(
+        body, headers = encode_webhook_body(data)
+        response = _SESSION.post(
             webhook_url,
-            json=data,
-            headers={"Content-Type": "application/json"},
+            data=body,
+            headers=headers,
             timeout=30
         )
         response.raise_for_status()
@@ -222,7 +386,7 @@ def send_to_webhook(data: Dict[str, Any]) -> Dict[str, Any]:
 
 # Función de prueba
 if __name__ == "__main__":
-    test_urls = ["https://www.youtube.com/watch?v=nW-q3Xb8paU"]
-    
-    result = process_youtube_video(test_urls)
+    test_url = "https://www.youtube.com/watch?v=nW-q3Xb8paU"
+
+    result = transcribe_and_summarize(download_audio(test_url))
     print("Resultado:", result)
\ No newline at end of file
@@ -1,9 +1,37 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:q3qc4fM29b9AAEPu5eUu@db:5432/learning_platform_db")
-engine = create_engine(DATABASE_URL)
+# Pool de conexiones reutilizadas entre requests (por proceso de uvicorn)
+POOL_OPTIONS = dict(
+    pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "40")),
+    pool_pre_ping=True,  # Descarta conexiones cortadas sin fallar el request
+    pool_recycle=1800  # Renueva conexiones cada 30 minutos
+)
+# El engine asíncrono solo atiende /all (debug): pool chico para no agotar max_connections
+ASYNC_POOL_OPTIONS = dict(
+    POOL_OPTIONS,
+    pool_size=int(os.getenv("DB_ASYNC_POOL_SIZE", "2")),
+    max_overflow=int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "3"))
+)
+QUERY_CACHE_SIZE = 1200  # Sentencias compiladas que guarda cada engine (default 500)
+engine = create_engine(DATABASE_URL, query_cache_size=QUERY_CACHE_SIZE, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Engine asíncrono (asyncpg) para endpoints que no deben bloquear el event loop.
+# Solo existe si hay un driver asíncrono: con PostgreSQL se deriva de DATABASE_URL,
+# para otros motores hay que indicar ASYNC_DATABASE_URL (ej: sqlite+aiosqlite://).
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1) if DATABASE_URL.startswith("postgresql://") else None
+)
+if ASYNC_DATABASE_URL:
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, query_cache_size=QUERY_CACHE_SIZE, **ASYNC_POOL_OPTIONS)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+else:
+    async_engine = None
+    AsyncSessionLocal = None
 Base = declarative_base()
\ No newline at end of file
@@ -1,18 +1,38 @@
 # job_manager.py
+import os
+import json
 import uuid
+import time
 import threading
+import redis
 import requests
-from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional, Callable
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Callable, Tuple
 from enum import Enum
 from learning_platform.schema import ProcessingStatus
+from learning_platform.webhook import encode_webhook_body
+
+# Sesión HTTP compartida (keep-alive) para los webhooks
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.2)))
 
 class JobManager:
     """Gestor de trabajos asíncronos en memoria"""
     
-    def __init__(self):
+    def __init__(self, max_workers: int = 4):
         self.storage = {}
-        self.active_threads = {}
+        # Protege storage, _updated_at y active_jobs (accedidos desde varios hilos)
+        self._lock = threading.RLock()
+        # job_id -> última actualización (epoch), ordenado de más antiguo a más reciente
+        self._updated_at: "OrderedDict[str, float]" = OrderedDict()
+        self.active_jobs: Dict[str, Future] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        # Un solo hilo para los webhooks: no bloquean el job y llegan en orden
+        self._webhook_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="webhook")
     
     def create_job(
         self, 
@@ -31,8 +51,9 @@ class JobManager:
             webhook_url: URL para notificaciones
         """
         job_id = str(uuid.uuid4())
+        now = time.time()
         
-        self.storage[job_id] = {
+        job = {
             "id": job_id,
             "type": job_type,
             "status": ProcessingStatus.PENDING,
@@ -46,24 +67,37 @@ class JobManager:
             },
             "results": [],
             "error": None,
-            "created_at": datetime.now(),
-            "updated_at": datetime.now(),
+            "created_at": now,
+            "updated_at": now,
             "metadata": {}
         }
+        with self._lock:
+            self.storage[job_id] = job
+            self._updated_at[job_id] = now
         
         return job_id
     
     def get_job(self, job_id: str) -> Optional[Dict]:
-        """Obtener información de un job"""
-        return self.storage.get(job_id)
+        """Obtener una copia consistente de la información de un job"""
+        with self._lock:
+            job = self.storage.get(job_id)
+            return self._snapshot(job) if job else None
     
+    def _snapshot(self, job: Dict) -> Dict:
+        """Copiar un job para leerlo fuera del lock sin ver actualizaciones a medias"""
+        snapshot = dict(job)
+        snapshot["progress"] = dict(job["progress"])
+        snapshot["results"] = list(job["results"])
+        return snapshot
     
     def delete_job(self, job_id: str) -> bool:
         """Eliminar un job"""
-        if job_id in self.storage:
-            del self.storage[job_id]
-            return True
-        return False
+        with self._lock:
+            if job_id in self.storage:
+                del self.storage[job_id]
+                self._updated_at.pop(job_id, None)
+                return True
+            return False
     
     def execute_job_async(
         self, 
@@ -73,31 +107,51 @@ class JobManager:
         **kwargs
     ) -> bool:
         """
-        Ejecutar un job en background usando threading
+        Ejecutar un job en background en el pool de workers
         
         Args:
             job_id: ID del job
             worker_function: Función que procesará el job
             *args, **kwargs: Argumentos para la función worker
         """
-        if job_id not in self.storage:
-            return False
-        
         # Marcar como procesando
-        self.update_job(job_id, status=ProcessingStatus.PROCESSING)
-        
-        # Crear y ejecutar thread
-        thread = threading.Thread(
-            target=self._execute_worker,
-            args=(job_id, worker_function, args, kwargs),
-            daemon=True
-        )
+        if not self.update_job(job_id, status=ProcessingStatus.PROCESSING):
+            return False
         
-        self.active_threads[job_id] = thread
-        thread.start()
+        # Encolar en el pool (como máximo max_workers jobs simultáneos)
+        with self._lock:
+            future = self._pool.submit(
+                self._execute_worker, job_id, worker_function, args, kwargs
+            )
+            self.active_jobs[job_id] = future
+        future.add_done_callback(lambda _: self._release_job(job_id))
         
         return True
     
+    def run_job(
+        self,
+        job_id: str,
+        worker_function: Callable,
+        *args,
+        **kwargs
+    ) -> bool:
+        """
+        Ejecutar un job PENDING en el hilo actual (ej: desde un worker de Celery)
+
+        Returns:
+            False si el job no existe o ya lo tomó otro worker
+        """
+        if not self.claim_job(job_id):
+            return False
+
+        self._execute_worker(job_id, worker_function, args, kwargs)
+        return True
+    
+    def _release_job(self, job_id: str):
+        """Quitar un job de los activos al terminar su Future"""
+        with self._lock:
+            self.active_jobs.pop(job_id, None)
+    
     def _execute_worker(
         self, 
         job_id: str, 
@@ -130,11 +184,6 @@ class JobManager:
             
             # Enviar notificación de error
             self._send_error_webhook(job_id, str(e))
-        
-        finally:
-            # Limpiar thread activo
-            if job_id in self.active_threads:
-                del self.active_threads[job_id]
     
     def _send_completion_webhook(self, job_id: str):
         """Enviar webhook de job completado"""
@@ -174,30 +223,43 @@ class JobManager:
     
     def send_progress_webhook(self, job_id: str, data: Dict[str, Any]):
         """Enviar webhook de progreso"""
-        job = self.get_job(job_id)
-        if not job or not job.get("webhook_url"):
-            return
-        
-        payload = {
-            "type": "job_progress",
-            "job_id": job_id,
-            "job_type": job["type"],
-           #"user_id": job["user_id"],
-            "progress": job["progress"],
-            "data": data,
-            "timestamp": datetime.now().isoformat()
-        }
+        request = self.build_progress_webhook(job_id, data)
+        if request:
+            self._send_webhook(*request)
+    
+    def build_progress_webhook(self, job_id: str, data: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Construir (url, payload) del webhook de progreso, o None si el job no tiene webhook"""
+        # Sin snapshot completo: el progreso no incluye la lista de resultados
+        with self._lock:
+            job = self.storage.get(job_id)
+            if not job or not job.get("webhook_url"):
+                return None
+            
+            payload = {
+                "type": "job_progress",
+                "job_id": job_id,
+                "job_type": job["type"],
+               #"user_id": job["user_id"],
+                "progress": dict(job["progress"]),
+                "data": data,
+                "timestamp": datetime.now().isoformat()
+            }
         
-        self._send_webhook(job["webhook_url"], payload)
+        return job["webhook_url"], payload
     
     def _send_webhook(self, webhook_url: str, payload: Dict[str, Any]):
+        """Encolar el envío del payload al webhook sin bloquear al llamador"""
+        self._webhook_pool.submit(self._post_webhook, webhook_url, payload)
+
+    def _post_webhook(self, webhook_url: str, payload: Dict[str, Any]):
         """Enviar payload al webhook"""
         try:
-            response = requests.post(
+            body, headers = encode_webhook_body(payload)
+            response = _SESSION.post(
                 webhook_url,
-                json=payload,
+                data=body,
                 timeout=30,
-                headers={"Content-Type": "application/json"}
+                headers=headers
             )
             print(f"📤 Webhook enviado: {response.status_code}")
         except Exception as e:
@@ -205,50 +267,281 @@ class JobManager:
     
     def get_active_jobs(self) -> List[str]:
         """Obtener lista de jobs activos"""
-        return list(self.active_threads.keys())
+        with self._lock:
+            return list(self.active_jobs.keys())
     
     def cleanup_old_jobs(self, days: int = 7):
         """Limpiar jobs antiguos (para evitar memory leaks)"""
-        cutoff_date = datetime.now() - timedelta(days=days)
-        jobs_to_delete = []
+        cutoff = time.time() - days * 86400
+        deleted = 0
         
-        for job_id, job_data in self.storage.items():
-            if job_data["updated_at"] < cutoff_date:
-                jobs_to_delete.append(job_id)
+        # _updated_at está ordenado por antigüedad: solo se recorren los expirados
+        with self._lock:
+            while self._updated_at:
+                job_id, updated_at = next(iter(self._updated_at.items()))
+                if updated_at >= cutoff:
+                    break
+                self.delete_job(job_id)
+                deleted += 1
         
-        for job_id in jobs_to_delete:
-            self.delete_job(job_id)
-        
-        return len(jobs_to_delete)
+        return deleted
 
-    # FUNCIONES NO UTILIZADAS
     def update_job(self, job_id: str, **kwargs) -> bool:
         """Actualizar datos de un job"""
-        if job_id not in self.storage:
-            return False
+        with self._lock:
+            if job_id not in self.storage:
+                return False
+                
+            self.storage[job_id].update(kwargs)
+            self._touch(job_id)
             
-        self.storage[job_id].update(kwargs)
-        self.storage[job_id]["updated_at"] = datetime.now()
-        
-        # Actualizar progreso automáticamente
-        if "completed_items" in kwargs:
-            total = self.storage[job_id]["progress"]["total_items"]
-            completed = kwargs["completed_items"]
-            if total > 0:
-                percentage = (completed / total) * 100
-                self.storage[job_id]["progress"]["percentage"] = percentage
-        
-        return True
+            # Actualizar progreso automáticamente
+            if "completed_items" in kwargs:
+                self._set_completed(self.storage[job_id], kwargs["completed_items"])
+            
+            return True
+
+    def claim_job(self, job_id: str) -> bool:
+        """Pasar un job de PENDING a PROCESSING; False si no existe o ya fue tomado"""
+        with self._lock:
+            job = self.storage.get(job_id)
+            if not job or job["status"] != ProcessingStatus.PENDING:
+                return False
+
+            job["status"] = ProcessingStatus.PROCESSING
+            self._touch(job_id)
+            return True
+
+    def add_result(self, job_id: str, result: Dict[str, Any]) -> bool:
+        """Agregar el resultado de un item terminado y avanzar el progreso en uno"""
+        with self._lock:
+            if job_id not in self.storage:
+                return False
+            
+            job = self.storage[job_id]
+            job["results"].append(result)
+            self._set_completed(job, job["progress"]["completed_items"] + 1)
+            self._touch(job_id)
+            
+            return True
+
+    def _touch(self, job_id: str):
+        """Marcar un job como actualizado ahora (llamar con el lock tomado)"""
+        now = time.time()
+        self.storage[job_id]["updated_at"] = now
+        self._updated_at.move_to_end(job_id)
+        self._updated_at[job_id] = now
+
+    def _set_completed(self, job: Dict, completed: int):
+        """Actualizar items completados y porcentaje (llamar con el lock tomado)"""
+        job["progress"]["completed_items"] = completed
+        total = job["progress"]["total_items"]
+        if total > 0:
+            job["progress"]["percentage"] = (completed / total) * 100
 
     def get_user_jobs(self, user_id: int, job_type: Optional[str] = None) -> List[Dict]:
         """Obtener todos los jobs de un usuario"""
         user_jobs = []
-        for job_id, job_data in self.storage.items():
-            if job_data.get("user_id") == user_id:
-                if job_type is None or job_data.get("type") == job_type:
-                    user_jobs.append(job_data)
+        with self._lock:
+            for job_id, job_data in self.storage.items():
+                if job_data.get("user_id") == user_id:
+                    if job_type is None or job_data.get("type") == job_type:
+                        user_jobs.append(self._snapshot(job_data))
+        return user_jobs
+
+
+# Escrituras sobre un job existente: comprobar y escribir en un solo paso atómico,
+# para no recrear a medias un hash borrado o expirado entre medio.
+# KEYS: job:{id}, job:{id}:results, jobs. ARGV: job_id, now, ttl, ...
+_UPDATE_JOB_LUA = """
+if redis.call("EXISTS", KEYS[1]) == 0 then return 0 end
+for i = 4, #ARGV, 2 do redis.call("HSET", KEYS[1], ARGV[i], ARGV[i + 1]) end
+redis.call("HSET", KEYS[1], "updated_at", ARGV[2])
+redis.call("EXPIRE", KEYS[1], ARGV[3])
+redis.call("EXPIRE", KEYS[2], ARGV[3])
+redis.call("ZADD", KEYS[3], ARGV[2], ARGV[1])
+return 1
+"""
+# ARGV: job_id, now, ttl, resultado en JSON
+_ADD_RESULT_LUA = """
+if redis.call("EXISTS", KEYS[1]) == 0 then return 0 end
+redis.call("RPUSH", KEYS[2], ARGV[4])
+redis.call("HINCRBY", KEYS[1], "completed_items", 1)
+redis.call("HSET", KEYS[1], "updated_at", ARGV[2])
+redis.call("EXPIRE", KEYS[1], ARGV[3])
+redis.call("EXPIRE", KEYS[2], ARGV[3])
+redis.call("ZADD", KEYS[3], ARGV[2], ARGV[1])
+return 1
+"""
+# ARGV: job_id, now, ttl, estado esperado, estado nuevo (en JSON)
+_CLAIM_JOB_LUA = """
+if redis.call("HGET", KEYS[1], "status") ~= ARGV[4] then return 0 end
+redis.call("HSET", KEYS[1], "status", ARGV[5], "updated_at", ARGV[2])
+redis.call("EXPIRE", KEYS[1], ARGV[3])
+redis.call("EXPIRE", KEYS[2], ARGV[3])
+redis.call("ZADD", KEYS[3], ARGV[2], ARGV[1])
+return 1
+"""
+
+class RedisJobManager(JobManager):
+    """
+    Gestor de trabajos con el estado en Redis
+
+    Cada job es un hash job:{id} (valores en JSON) y sus resultados una lista
+    job:{id}:results; el sorted set "jobs" los ordena por última actualización.
+    Las operaciones de Redis son atómicas, así que el estado se comparte entre
+    procesos de uvicorn sin lock. Los futures de active_jobs siguen siendo locales.
+    Cada escritura renueva el TTL del job: se borra solo JOB_TTL después de su
+    última actualización.
+    """
+
+    JOB_TTL = 7 * 86400
+
+    def __init__(self, url: str, max_workers: int = 4):
+        super().__init__(max_workers=max_workers)
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._update_job_script = self._redis.register_script(_UPDATE_JOB_LUA)
+        self._add_result_script = self._redis.register_script(_ADD_RESULT_LUA)
+        self._claim_job_script = self._redis.register_script(_CLAIM_JOB_LUA)
+
+    def create_job(
+        self,
+        job_type: str,
+        job_data: Dict[str, Any],
+        webhook_url: Optional[str] = None
+    ) -> str:
+        """Crear un nuevo job (ver JobManager.create_job)"""
+        job_id = str(uuid.uuid4())
+        now = time.time()
+
+        fields = {
+            "id": job_id,
+            "type": job_type,
+            "status": ProcessingStatus.PENDING,
+            "data": job_data,
+            "webhook_url": webhook_url,
+            "total_items": job_data.get("total_items", 0),
+            "completed_items": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "metadata": {}
+        }
+        pipe = self._redis.pipeline()
+        pipe.hset(f"job:{job_id}", mapping={k: json.dumps(v) for k, v in fields.items()})
+        pipe.expire(f"job:{job_id}", self.JOB_TTL)
+        pipe.zadd("jobs", {job_id: now})
+        # Índice sin TTL propio: quitar los jobs que ya expiraron
+        pipe.zremrangebyscore("jobs", "-inf", f"({now - self.JOB_TTL}")
+        pipe.execute()
+
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Obtener la información de un job"""
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.hgetall(f"job:{job_id}")
+        pipe.lrange(f"job:{job_id}:results", 0, -1)
+        fields, results = pipe.execute()
+        if not fields:
+            return None
+
+        job = {k: json.loads(v) for k, v in fields.items()}
+        total = job.pop("total_items")
+        completed = job.pop("completed_items")
+        job["status"] = ProcessingStatus(job["status"])
+        job["progress"] = {
+            "total_items": total,
+            "completed_items": completed,
+            "percentage": (completed / total) * 100 if total > 0 else 0
+        }
+        job["results"] = [json.loads(r) for r in results]
+        return job
+
+    def delete_job(self, job_id: str) -> bool:
+        """Eliminar un job"""
+        pipe = self._redis.pipeline()
+        pipe.delete(f"job:{job_id}", f"job:{job_id}:results")
+        pipe.zrem("jobs", job_id)
+        deleted, _ = pipe.execute()
+        return deleted > 0
+
+    def build_progress_webhook(self, job_id: str, data: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Construir (url, payload) del webhook de progreso, o None si el job no tiene webhook"""
+        # Solo los campos del progreso: no se leen los resultados
+        values = self._redis.hmget(f"job:{job_id}", "type", "webhook_url", "total_items", "completed_items")
+        if values[0] is None:
+            return None
+
+        job_type, webhook_url, total, completed = (json.loads(v) for v in values)
+        if not webhook_url:
+            return None
+
+        payload = {
+            "type": "job_progress",
+            "job_id": job_id,
+            "job_type": job_type,
+            "progress": {
+                "total_items": total,
+                "completed_items": completed,
+                "percentage": (completed / total) * 100 if total > 0 else 0
+            },
+            "data": data,
+            "timestamp": datetime.now().isoformat()
+        }
+        return webhook_url, payload
+
+    def cleanup_old_jobs(self, days: int = 7):
+        """Limpiar jobs antiguos"""
+        cutoff = time.time() - days * 86400
+        expired = self._redis.zrangebyscore("jobs", "-inf", f"({cutoff}")
+        for job_id in expired:
+            self.delete_job(job_id)
+        return len(expired)
+
+    def update_job(self, job_id: str, **kwargs) -> bool:
+        """Actualizar datos de un job"""
+        fields = [item for k, v in kwargs.items() for item in (k, json.dumps(v))]
+        return self._update_job_script(
+            keys=[f"job:{job_id}", f"job:{job_id}:results", "jobs"],
+            args=[job_id, json.dumps(time.time()), self.JOB_TTL, *fields]
+        ) == 1
+
+    def claim_job(self, job_id: str) -> bool:
+        """Pasar un job de PENDING a PROCESSING; False si no existe o ya fue tomado"""
+        return self._claim_job_script(
+            keys=[f"job:{job_id}", f"job:{job_id}:results", "jobs"],
+            args=[job_id, json.dumps(time.time()), self.JOB_TTL,
+                  json.dumps(ProcessingStatus.PENDING), json.dumps(ProcessingStatus.PROCESSING)]
+        ) == 1
+
+    def add_result(self, job_id: str, result: Dict[str, Any]) -> bool:
+        """Agregar el resultado de un item terminado y avanzar el progreso en uno"""
+        return self._add_result_script(
+            keys=[f"job:{job_id}", f"job:{job_id}:results", "jobs"],
+            args=[job_id, json.dumps(time.time()), self.JOB_TTL, json.dumps(result)]
+        ) == 1
+
+    def get_user_jobs(self, user_id: int, job_type: Optional[str] = None) -> List[Dict]:
+        """Obtener todos los jobs de un usuario"""
+        job_ids = self._redis.zrangebyscore("jobs", time.time() - self.JOB_TTL, "+inf")
+
+        # Filtrar con los campos del hash; los resultados solo se leen de los jobs elegidos
+        pipe = self._redis.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hmget(f"job:{job_id}", "user_id", "type")
+        user_jobs = []
+        for job_id, (owner, kind) in zip(job_ids, pipe.execute()):
+            if owner is None or json.loads(owner) != user_id:
+                continue
+            if job_type is None or json.loads(kind) == job_type:
+                job = self.get_job(job_id)
+                if job:
+                    user_jobs.append(job)
         return user_jobs
 
 
-# Instancia global del job manager
-job_manager = JobManager()
\ No newline at end of file
+# Instancia global del job manager: en Redis si está configurado.
+# Va en una instancia propia, sin desalojo: la de REDIS_URL es una caché LRU.
+JOBS_REDIS_URL = os.getenv("JOBS_REDIS_URL")
+job_manager = RedisJobManager(JOBS_REDIS_URL) if JOBS_REDIS_URL else JobManager()
\ No newline at end of file
@@ -1,20 +1,52 @@
+import asyncio
+import logging
+import os
 from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import func, case, select, text
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from learning_platform.models import *
 from learning_platform.schema import *
-from learning_platform.database import SessionLocal, engine
+from learning_platform.database import SessionLocal, AsyncSessionLocal, engine
 from learning_platform.auth import authenticate_user, create_access_token, get_current_user, get_password_hash, ACCESS_TOKEN_EXPIRE_MINUTES
 from learning_platform.job_manager import job_manager
 from learning_platform.video_processor import process_videos_worker
+from learning_platform.tasks import CELERY_BROKER_URL, process_videos
+from learning_platform.ai import check_dependencies, warm_up_models
 from learning_platform.schema import ProcessingStatus
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
 # Base.metadata.drop_all(bind=engine)
 # Crear las tablas
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Learning Platform API")
+app = FastAPI(title="Learning Platform API", default_response_class=ORJSONResponse)
+
+@app.on_event("startup")
+def load_ai_models():
+    """Cargar los modelos de IA al iniciar para que el primer job no pague la carga"""
+    # Con Celery la API no transcribe: los modelos se cargan en el worker
+    if CELERY_BROKER_URL:
+        return
+    check_dependencies()
+    try:
+        warm_up_models()
+    except Exception as e:
+        print(f"❌ No se pudieron precargar los modelos: {e}")
+
+# Columnas de los endpoints de lectura (evita hidratar objetos ORM)
+USER_COLUMNS = (User.id, User.username)
+GOAL_COLUMNS = (LearningGoal.id, LearningGoal.title, LearningGoal.user_id, LearningGoal.completed)
+TASK_COLUMNS = (Task.id, Task.title, Task.goal_id, Task.completed, Task.task_metadata)
+
+# Sentencias de /all construidas una sola vez (hijas antes que padres)
+TRUNCATE_ALL = text("TRUNCATE TABLE tasks, goals, users CASCADE")
+DELETE_ALL = (Task.__table__.delete(), LearningGoal.__table__.delete(), User.__table__.delete())
 
 # Dependency para obtener la sesión de BD
 def get_db():
@@ -24,11 +56,19 @@ def get_db():
     finally:
         db.close()
 
+# Dependency para obtener una sesión asíncrona de BD (None si no hay driver asíncrono)
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        yield None
+        return
+    async with AsyncSessionLocal() as db:
+        yield db
+
 #=======================
 # AUTHENTICATION
 #=======================
 @app.post("/register/oauth", response_model=UserResponse)
-async def register_user(user: UserAuth, db: Session = Depends(get_db)):
+def register_user(user: UserAuth, db: Session = Depends(get_db)):
     """Registrar nuevo usuario"""
     # Verificar si el usuario ya existe
     existing_user = db.query(User).filter(User.username == user.username).first()
@@ -46,7 +86,7 @@ async def register_user(user: UserAuth, db: Session = Depends(get_db)):
     return db_user
 
 @app.post("/login/oauth", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """Login OAuth2 estándar"""
     user = authenticate_user(form_data.username, form_data.password, db)
     if not user:
@@ -79,43 +119,43 @@ async def root():
     return {"message": "Learning Platform API"}
 
 @app.get("/users", response_model=list[UserResponse])
-async def get_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
+def get_users(db: Session = Depends(get_db)):
+    users = db.execute(select(*USER_COLUMNS)).all()
     return users
 
 @app.get("/goals", response_model=list[LearningGoalResponse])
-async def get_goals(db: Session = Depends(get_db)):
-    goals = db.query(LearningGoal).all()
+def get_goals(db: Session = Depends(get_db)):
+    goals = db.execute(select(*GOAL_COLUMNS)).all()
     return goals
 
 @app.get("/tasks", response_model=list[TaskResponse])
-async def get_tasks(db: Session = Depends(get_db)):
-    tasks = db.query(Task).all()
+def get_tasks(db: Session = Depends(get_db)):
+    tasks = db.execute(select(*TASK_COLUMNS)).all()
     return tasks
 
 #=======================
 # GETS PROTEGIDOS
 #=======================
 @app.get("/my/goals", response_model=list[LearningGoalResponse])
-async def get_my_goals(
+def get_my_goals(
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Obtener goals del usuario autenticado"""
-    goals = db.query(LearningGoal).filter(
-        LearningGoal.user_id == current_user["user_id"]
+    goals = db.execute(
+        select(*GOAL_COLUMNS).where(LearningGoal.user_id == current_user["user_id"])
     ).all()
     return goals
 
 @app.get("/my/goals/{goal_id}/tasks", response_model=list[TaskResponse])
-async def get_my_goal_tasks(
+def get_my_goal_tasks(
     goal_id: int,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Obtener tasks de un goal del usuario autenticado"""
     # Verificar que el goal pertenece al usuario
-    goal = db.query(LearningGoal).filter(
+    goal = db.query(LearningGoal.id).filter(
         LearningGoal.id == goal_id,
         LearningGoal.user_id == current_user["user_id"]
     ).first()
@@ -123,14 +163,14 @@ async def get_my_goal_tasks(
     if not goal:
         raise HTTPException(status_code=404, detail="Goal not found")
     
-    tasks = db.query(Task).filter(Task.goal_id == goal_id).all()
+    tasks = db.execute(select(*TASK_COLUMNS).where(Task.goal_id == goal_id)).all()
     return tasks
 
 #=======================
 # POSTS PROTEGIDOS
 #=======================
 @app.post("/my/goals", response_model=LearningGoalResponse)
-async def create_my_learning_goal(
+def create_my_learning_goal(
     goal: LearningGoalCreate, 
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -146,7 +186,7 @@ async def create_my_learning_goal(
     return db_goal
 
 @app.post("/my/goals/{goal_id}/tasks", response_model=TaskResponse)
-async def create_my_task(
+def create_my_task(
     goal_id: int,
     task: TaskCreate, 
     current_user: dict = Depends(get_current_user),
@@ -213,13 +253,15 @@ async def process_videos_async(
             webhook_url=webhook_url
         )
         
-        # Ejecutar procesamiento asíncrono
-        job_manager.execute_job_async(
-            job_id,
-            process_videos_worker,
-            request.youtube_urls,
-            webhook_url
-        )
+        # Ejecutar procesamiento asíncrono: en un worker de Celery si hay broker
+        if CELERY_BROKER_URL:
+            process_videos.apply_async(args=[job_id, request.youtube_urls], task_id=job_id)
+        else:
+            job_manager.execute_job_async(
+                job_id,
+                process_videos_worker,
+                request.youtube_urls
+            )
         
         # Retornar inmediatamente
         return VideoProcessAsyncResponse(
@@ -270,7 +312,7 @@ async def get_job_status(
     )
 
 @app.get("/ai/jobs", response_model=List[VideoProcessStatusResponse])
-async def get_my_jobs(
+def get_my_jobs(
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -300,37 +342,28 @@ async def get_my_jobs(
 
 def check_and_complete_goal(goal_id: int, db: Session):
     """Verificar si todas las tasks están completadas y marcar el goal como completado"""
-    # Contar tasks totales del goal
-    total_tasks = db.query(Task).filter(Task.goal_id == goal_id).count()
+    # Contar tasks totales y completadas del goal en una sola consulta
+    total_tasks, completed_tasks = db.query(
+        func.count(),
+        func.coalesce(func.sum(case((Task.completed == True, 1), else_=0)), 0)
+    ).filter(Task.goal_id == goal_id).one()
     
     # Si no hay tasks, no completar el goal automáticamente
     if total_tasks == 0:
         return False
     
-    # Contar tasks completadas del goal
-    completed_tasks = db.query(Task).filter(
-        Task.goal_id == goal_id,
-        Task.completed == True
-    ).count()
-    
-    # Si todas las tasks están completadas, marcar goal como completado
-    if total_tasks == completed_tasks:
-        goal = db.query(LearningGoal).filter(LearningGoal.id == goal_id).first()
-        goal.completed = True
-        db.commit()
-        return True
-    
-    # Si hay tasks incompletas, marcar goal como incompleto
-    else:
-        goal = db.query(LearningGoal).filter(LearningGoal.id == goal_id).first()
-        if goal.completed:
-            goal.completed = False
-            db.commit()
+    # Marcar goal como completado o incompleto solo si cambia su estado
+    goal_completed = total_tasks == completed_tasks
+    db.query(LearningGoal).filter(
+        LearningGoal.id == goal_id,
+        LearningGoal.completed.is_distinct_from(goal_completed)
+    ).update({"completed": goal_completed}, synchronize_session=False)
+    db.commit()
     
-    return False
+    return goal_completed
 
 @app.put("/my/goals/{goal_id}/tasks/{task_id}", response_model=TaskUpdateResponse)
-async def update_my_task(
+def update_my_task(
     goal_id: int,
     task_id: int, 
     current_user: dict = Depends(get_current_user),
@@ -374,7 +407,7 @@ async def update_my_task(
 # DELETES
 #=======================
 @app.delete("/my/goals/{goal_id}")
-async def delete_goal(
+def delete_goal(
     goal_id: int, 
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -406,13 +439,31 @@ async def delete_goal(
 # DELETE ALL TASKS FOR DEBUG
 # =============================
     
-@app.delete("/all")
-async def delete_all(db: Session = Depends(get_db)):
+def delete_all_sync():
+    """Borrar todas las tablas con la sesión síncrona (motores sin driver asíncrono)"""
+    db = SessionLocal()
     try:
-        db.query(Task).delete()
-        db.query(LearningGoal).delete()
-        db.query(User).delete()
+        for statement in DELETE_ALL:
+            db.execute(statement)
         db.commit()
+    finally:
+        db.close()
+
+@app.delete("/all")
+async def delete_all(db: Optional[AsyncSession] = Depends(get_async_db)):
+    try:
+        # Sin engine asíncrono: DELETE masivos en un hilo para no bloquear el event loop
+        if db is None:
+            await asyncio.to_thread(delete_all_sync)
+            return {"message": "All data deleted successfully"}
+
+        # Un único TRUNCATE en Postgres; DELETE masivos (sin cargar filas) en otros motores
+        if db.bind.dialect.name == "postgresql":
+            await db.execute(TRUNCATE_ALL)
+        else:
+            for statement in DELETE_ALL:
+                await db.execute(statement)
+        await db.commit()
         return {"message": "All data deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
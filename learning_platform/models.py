@@ -1,23 +1,51 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, ForeignKey, JSON, Index, Sequence, DDL, event
+from sqlalchemy.dialects.postgresql import JSONB
 from learning_platform.database import Base
 
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, unique=True, index=True)
+    username = Column(String, unique=True)
     password_hash = Column(String)  # ✅ Agregar campo para contraseña hasheada
 
+    __table_args__ = (
+        # Cubriente: el login se resuelve con un index-only scan (INCLUDE solo en PostgreSQL).
+        # La unicidad la sigue garantizando la constraint de la columna.
+        Index("ix_users_username_covering", "username", postgresql_include=["password_hash", "id"]),
+    )
+
 class LearningGoal(Base):
     __tablename__ = "goals"
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     completed = Column(Boolean, default=False)
 
+# Reserva ids de a 100 por conexión en vez de uno por insert (ignorada fuera de PostgreSQL)
+TASK_ID_SEQ = Sequence("tasks_id_seq", cache=100)
+
 class Task(Base):
     __tablename__ = "tasks"
-    id = Column(Integer, primary_key=True, index=True)
+    # En SQLite solo INTEGER PRIMARY KEY es autoincremental
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), TASK_ID_SEQ, primary_key=True, index=True)
     title = Column(String)
     goal_id = Column(Integer, ForeignKey("goals.id"))
-    task_metadata = Column(JSON)
-    completed = Column(Boolean, default=False)
\ No newline at end of file
+    task_metadata = Column(JSON().with_variant(JSONB, "postgresql"))
+    completed = Column(Boolean, default=False)
+
+    __table_args__ = (
+        # Permite contar tasks totales/completadas de un goal solo con el índice
+        Index("ix_task_goal_completed", "goal_id", "completed"),
+        # Consultas de contención (@>) sobre la metadata
+        Index("ix_tasks_metadata_gin", "task_metadata", postgresql_using="gin"),
+    )
+
+# Default en la base (como SERIAL) para inserts fuera del ORM; solo PostgreSQL
+event.listen(
+    Task.__table__,
+    "after_create",
+    DDL(
+        "ALTER TABLE tasks ALTER COLUMN id SET DEFAULT nextval('tasks_id_seq'); "
+        "ALTER SEQUENCE tasks_id_seq OWNED BY tasks.id"
+    ).execute_if(dialect="postgresql")
+)
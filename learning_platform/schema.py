@@ -1,5 +1,5 @@
 from typing import Dict, Any, List, Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from enum import Enum
 
 class ProcessingStatus(str, Enum):
@@ -16,8 +16,7 @@ class UserResponse(BaseModel):
     id: int
     username: str
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class LearningGoalCreate(BaseModel):
     title: str
@@ -28,8 +27,7 @@ class LearningGoalResponse(BaseModel):
     user_id: int
     completed: bool
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class TaskCreate(BaseModel):
     title: str
@@ -42,8 +40,7 @@ class TaskResponse(BaseModel):
     completed: bool
     task_metadata: Dict[str, Any] = Field(default_factory=dict)
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class TaskUpdateResponse(TaskResponse):
     goal_auto_completed: bool
@@ -0,0 +1,41 @@
+# tasks.py
+import os
+from celery import Celery
+from celery.signals import worker_process_init
+from typing import List
+from learning_platform.ai import warm_up_models
+from learning_platform.job_manager import RedisJobManager, job_manager
+from learning_platform.video_processor import process_videos_worker
+
+# Sin broker configurado los jobs se ejecutan en el pool del propio proceso
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
+
+# API y worker comparten el estado de los jobs a través de Redis
+if CELERY_BROKER_URL and not isinstance(job_manager, RedisJobManager):
+    raise RuntimeError("CELERY_BROKER_URL requiere JOBS_REDIS_URL para compartir el estado de los jobs")
+
+# Con acks_late Redis reentrega las tareas no confirmadas tras visibility_timeout:
+# tiene que superar al job más largo (ver también run_job en process_videos)
+VISIBILITY_TIMEOUT = int(os.getenv("CELERY_VISIBILITY_TIMEOUT", str(6 * 3600)))
+
+# Sin result backend: el estado de cada job se lee del JobManager, no de AsyncResult
+celery_app = Celery("learning_platform", broker=CELERY_BROKER_URL)
+celery_app.conf.update(
+    task_ignore_result=True,
+    task_acks_late=True,
+    worker_prefetch_multiplier=1,  # Un job de videos por proceso a la vez
+    broker_transport_options={"visibility_timeout": VISIBILITY_TIMEOUT}
+)
+
+@worker_process_init.connect
+def load_ai_models(**kwargs):
+    """Cargar los modelos de IA al arrancar cada proceso del worker"""
+    warm_up_models()
+
+@celery_app.task(name="process_videos")
+def process_videos(job_id: str, youtube_urls: List[str]):
+    """Procesar en un worker de Celery un job creado por la API"""
+    # Solo la primera entrega toma el job: una reentrega (o un job borrado
+    # o expirado en la cola) no lo reprocesa ni repite sus webhooks.
+    # El progreso, los resultados y los webhooks se escriben en el job compartido.
+    job_manager.run_job(job_id, process_videos_worker, youtube_urls)
@@ -1,62 +1,195 @@
 # video_processor.py
-from datetime import time
-from typing import List, Dict, Any
-from learning_platform.ai import process_youtube_video
-import threading
-import traceback
+import asyncio
+import json
+import logging
+import os
+import re
+import httpx
+import redis.asyncio as redis
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+from learning_platform.webhook import encode_webhook_body
+from learning_platform.ai import DOWNLOAD_WORKERS, WHISPER_WORKERS, check_dependencies, download_audio, transcribe_video, summarize_transcription, resend_result
+import time
 
-def process_single_video(url, i, results, job_id, job_manager):
-    import time
-    t0 = time.time()
-    print(f"⏳ [Video {i+1}] Inicio procesamiento: {url}")
+log = logging.getLogger(__name__)
+
+WEBHOOK_TIMEOUT = httpx.Timeout(30.0)
+WEBHOOK_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+PROGRESS_WEBHOOK_INTERVAL = 0.5  # Segundos mínimos entre webhooks de progreso de un job
+
+# Pool compartido por todos los jobs que limita las transcripciones simultáneas.
+# CTranslate2 libera el GIL durante la inferencia, así que alcanza con hilos.
+# El resumen (Gemini) y el webhook de n8n son I/O y corren fuera de este pool.
+TRANSCRIBE_POOL = ThreadPoolExecutor(max_workers=WHISPER_WORKERS, thread_name_prefix="transcribe")
+
+# Caché de resultados por video en Redis (opcional, desactivada sin REDIS_URL)
+REDIS_URL = os.getenv("REDIS_URL")
+RESULT_TTL = 86400  # 1 día
+VIDEO_ID_RE = re.compile(r"(?:v=|/shorts/|/embed/|youtu\.be/)([A-Za-z0-9_-]{11})")
+
+def extract_video_id(url: str) -> Optional[str]:
+    """Obtener el ID de un video de YouTube a partir de su URL"""
+    match = VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
+
+async def get_cached_result(cache: Optional[redis.Redis], video_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Buscar el resultado ya procesado de un video; None si no hay caché o no está"""
+    if cache is None or video_id is None:
+        return None
+    try:
+        cached = await cache.get(f"yt:{video_id}")
+    except Exception as e:
+        log.warning("video_id=%s cache=get error=%s", video_id, e)
+        return None
+    return json.loads(cached) if cached else None
+
+async def set_cached_result(cache: Optional[redis.Redis], video_id: Optional[str], video_result: Dict[str, Any]):
+    """Guardar el resultado de un video procesado correctamente (sin el estado de su webhook)"""
+    if cache is None or video_id is None or not video_result.get("success", False):
+        return
+    stored = {k: v for k, v in video_result.items() if k != "webhook_status"}
+    try:
+        await cache.set(f"yt:{video_id}", json.dumps(stored), ex=RESULT_TTL)
+    except Exception as e:
+        log.warning("video_id=%s cache=set error=%s", video_id, e)
+
+async def send_progress_webhook(http: httpx.AsyncClient, job_manager, job_id: str, data: Dict[str, Any]):
+    """Enviar webhook de progreso sin bloquear el event loop"""
+    request = job_manager.build_progress_webhook(job_id, data)
+    if not request:
+        return
+
+    webhook_url, payload = request
+    try:
+        body, headers = encode_webhook_body(payload)
+        response = await http.post(webhook_url, content=body, headers=headers)
+        log.debug("job=%s webhook=progress status=%d", job_id, response.status_code)
+    except Exception as e:
+        log.warning("job=%s webhook=progress error=%s", job_id, e)
+
+class JobProgress:
+    """
+    Progreso de un job de videos
+
+    Lleva la cuenta de videos terminados y agrupa los webhooks de progreso
+    para enviar como máximo uno cada PROGRESS_WEBHOOK_INTERVAL segundos.
+    Solo se usa desde el event loop del job, por lo que no necesita lock.
+    """
+
+    def __init__(self, job_id: str, job_manager, http: httpx.AsyncClient, total: int):
+        self.job_id = job_id
+        self.job_manager = job_manager
+        self.http = http
+        self.results: List[Dict[str, Any]] = [None] * total
+        self.completed = 0
+        self.succeeded = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._last_sent = 0.0
+        self._scheduled: Optional[asyncio.Task] = None
+        self._scheduled_sending = False
+
+    async def video_done(self, i: int, video_result: Dict[str, Any]):
+        """Registrar el resultado de un video y notificar si corresponde"""
+        self.results[i] = video_result
+        self.completed += 1
+        # Con RedisJobManager es una llamada bloqueante a Redis: fuera del event loop
+        await asyncio.to_thread(self.job_manager.add_result, self.job_id, video_result)
+
+        if video_result.get("success", False):
+            self.succeeded += 1
+            self._pending.append({"video_completed": video_result, "current_video": i + 1})
+        elapsed = time.monotonic() - self._last_sent
+        if elapsed >= PROGRESS_WEBHOOK_INTERVAL:
+            await self.flush()
+        elif self._pending and self._scheduled is None:
+            # Dentro del intervalo: enviar lo pendiente apenas se cumpla
+            self._scheduled = asyncio.create_task(self._flush_later(PROGRESS_WEBHOOK_INTERVAL - elapsed))
+
+    async def _flush_later(self, delay: float):
+        """Enviar los videos pendientes cuando termine el intervalo mínimo"""
+        # La referencia se mantiene hasta terminar el envío para que close() la espere
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                self._scheduled_sending = True
+                await self.flush()
+                self._scheduled_sending = False
+                # Videos que llegaron durante el envío: esperar otro intervalo
+                if not self._pending:
+                    break
+                delay = max(0.0, PROGRESS_WEBHOOK_INTERVAL - (time.monotonic() - self._last_sent))
+        finally:
+            self._scheduled = None
+            self._scheduled_sending = False
+
+    async def close(self):
+        """Esperar el envío en curso (o cancelar el que aún espera) y enviar lo pendiente"""
+        task = self._scheduled
+        if task is not None:
+            if self._scheduled_sending:
+                await task
+            else:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            # Una tarea cancelada antes de arrancar no pasa por su finally
+            self._scheduled = None
+        await self.flush()
+
+    async def flush(self):
+        """Enviar en un único webhook los videos completados pendientes"""
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, []
+        self._last_sent = time.monotonic()
+        t_webhook = time.perf_counter()
+        await send_progress_webhook(self.http, self.job_manager, self.job_id, {
+            "video_completed": pending[-1]["video_completed"],
+            "current_video": pending[-1]["current_video"],
+            "videos_completed": [p["video_completed"] for p in pending],
+        })
+        log.debug("job=%s phase=webhook videos=%d dt=%.2f", self.job_id, len(pending), time.perf_counter() - t_webhook)
+
+async def process_single_video(url, i, download_semaphore: asyncio.Semaphore, progress: JobProgress, cache: Optional[redis.Redis] = None):
+    t0 = time.perf_counter()
+    log.debug("video=%d phase=start url=%s", i + 1, url)
 
     try:
-        print(f"🟢 [Video {i+1}] Antes de process_youtube_video")
-        t_download = time.time()
-        result = process_youtube_video(url)
-        t_download_end = time.time()
-        print(f"⏱️ [Video {i+1}] Descarga y procesamiento: {t_download_end - t_download:.2f}s")
-
-        if result.get("success", False) and "results" in result and result["results"]:
-            video_result = result["results"][0]
-            results[i] = video_result
-
-            t_webhook = time.time()
-            job_manager.send_progress_webhook(job_id, {
-                "video_completed": video_result,
-                "current_video": i + 1,
-            })
-            t_webhook_end = time.time()
-            print(f"⏱️ [Video {i+1}] Envío webhook: {t_webhook_end - t_webhook:.2f}s")
-        else:
-            error_result = {
-                "url": url,
-                "error": result.get("error", "Unknown error"),
-                "success": False
-            }
-            results[i] = error_result
-
-        job_manager.update_job(
-            job_id,
-            completed_items=sum(1 for r in results if r is not None),
-            results=[r for r in results if r is not None]
-        )
-        print(f"✅ [Video {i+1}] Procesamiento total: {time.time() - t0:.2f}s")
+        # Video ya procesado: reenviar el resultado sin descargar ni transcribir
+        video_id = extract_video_id(url)
+        cached = await get_cached_result(cache, video_id)
+        if cached is not None:
+            await progress.video_done(i, await asyncio.to_thread(resend_result, cached, url))
+            log.info("video=%d phase=done cache=hit dt=%.2f", i + 1, time.perf_counter() - t0)
+            return
+
+        # Limitar descargas simultáneas; la transcripción no ocupa el cupo
+        async with download_semaphore:
+            video = await asyncio.to_thread(download_audio, url)
+        t_process = time.perf_counter()
+        log.debug("video=%d phase=download dt=%.2f", i + 1, t_process - t0)
+        loop = asyncio.get_running_loop()
+        segment_texts = await loop.run_in_executor(TRANSCRIBE_POOL, transcribe_video, video)
+        t_summary = time.perf_counter()
+        log.debug("video=%d phase=transcribe dt=%.2f", i + 1, t_summary - t_process)
+        video_result = await asyncio.to_thread(summarize_transcription, video, segment_texts)
+        log.debug("video=%d phase=summarize dt=%.2f", i + 1, time.perf_counter() - t_summary)
+        await set_cached_result(cache, video_id, video_result)
+
+        await progress.video_done(i, video_result)
+        log.info("video=%d phase=done success=%s dt=%.2f", i + 1, video_result.get("success", False), time.perf_counter() - t0)
     except Exception as e:
-        import traceback
         error_result = {
             "url": url,
             "error": str(e),
             "success": False
         }
-        results[i] = error_result
-        job_manager.update_job(
-            job_id,
-            completed_items=sum(1 for r in results if r is not None),
-            results=[r for r in results if r is not None]
-        )
-        print(f"❌ [Video {i+1}] Error: {str(e)} (total: {time.time() - t0:.2f}s)")
-        traceback.print_exc()
+        log.exception("video=%d phase=error dt=%.2f", i + 1, time.perf_counter() - t0)
+        await progress.video_done(i, error_result)
 
 def process_videos_worker(
     job_id: str, 
@@ -65,28 +198,48 @@ def process_videos_worker(
 ) -> Dict[str, Any]:
     """
     Worker function para procesar videos de YouTube
+
+    Corre en un hilo del JobManager y procesa los videos con asyncio.
+    """
+    log.info("job=%s phase=start videos=%d", job_id, len(youtube_urls))
+    if not check_dependencies():
+        raise RuntimeError("FFmpeg no disponible")
+
+    return asyncio.run(_process_videos(job_id, job_manager, youtube_urls))
+
+async def _process_videos(
+    job_id: str,
+    job_manager,
+    youtube_urls: List[str],
+) -> Dict[str, Any]:
+    """
+    Procesar todos los videos de un job de forma concurrente
+
+    Cada audio se transcribe en cuanto termina su descarga, mientras siguen
+    las demás descargas (como máximo DOWNLOAD_WORKERS a la vez).
     """
-    print(f"🎬 Iniciando procesamiento job {job_id}")
     n = len(youtube_urls)
-    results = [None] * n
-    threads = []
-    
-    for i, url in enumerate(youtube_urls):
-        t = threading.Thread(
-            target=process_single_video,
-            args=(url, i, results, job_id, job_manager)
-        )
-        t.start()
-        threads.append(t)
-
-    for t in threads:
-        t.join()  # Esperar a que todos los videos terminen
-
-    # Resultado final
-    final_results = [r for r in results if r is not None]
+    download_semaphore = asyncio.Semaphore(DOWNLOAD_WORKERS)
+
+    # Un cliente por job: cada job corre en su propio event loop
+    cache = redis.from_url(REDIS_URL) if REDIS_URL else None
+    try:
+        async with httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT, limits=WEBHOOK_LIMITS) as http:
+            progress = JobProgress(job_id, job_manager, http, n)
+            await asyncio.gather(*(
+                process_single_video(url, i, download_semaphore, progress, cache)
+                for i, url in enumerate(youtube_urls)
+            ))
+            # Enviar lo que haya quedado pendiente por el intervalo mínimo
+            await progress.close()
+    finally:
+        if cache is not None:
+            await cache.close()
+
+    # Resultado final (gather espera a todos los videos: no quedan huecos en results)
     return {
         "total_videos": n,
-        "successful_videos": len([r for r in final_results if r.get("success", False)]),
-        "failed_videos": len([r for r in final_results if not r.get("success", True)]),
-        "results": final_results
-    }
\ No newline at end of file
+        "successful_videos": progress.succeeded,
+        "failed_videos": progress.completed - progress.succeeded,
+        "results": progress.results
+    }
@@ -0,0 +1,18 @@
+# webhook.py
+import os
+import gzip
+import orjson
+from typing import Dict, Any, Tuple
+
+# Comprimir con gzip los payloads de webhook grandes (WEBHOOK_GZIP=0 si el receptor no lo soporta)
+WEBHOOK_GZIP = os.getenv("WEBHOOK_GZIP", "1") == "1"
+WEBHOOK_GZIP_MIN_BYTES = 1024
+
+def encode_webhook_body(payload: Dict[str, Any]) -> Tuple[bytes, Dict[str, str]]:
+    """Serializar un payload de webhook a (body, headers), comprimido si supera WEBHOOK_GZIP_MIN_BYTES"""
+    body = orjson.dumps(payload)
+    headers = {"Content-Type": "application/json"}
+    if WEBHOOK_GZIP and len(body) >= WEBHOOK_GZIP_MIN_BYTES:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
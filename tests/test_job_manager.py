@@ -0,0 +1,41 @@
+import fakeredis
+import pytest
+from learning_platform import job_manager as job_manager_module
+from learning_platform.job_manager import RedisJobManager
+from learning_platform.schema import ProcessingStatus
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(job_manager_module.redis, "Redis", fakeredis.FakeRedis)
+    return RedisJobManager("redis://localhost:6379/0")
+
+
+def test_update_job_missing_key_does_not_recreate_hash(manager):
+    assert manager.update_job("missing", status=ProcessingStatus.FAILED) is False
+    assert manager._redis.exists("job:missing") == 0
+    assert manager.get_job("missing") is None
+
+
+def test_add_result_missing_key_does_not_recreate_hash(manager):
+    assert manager.add_result("missing", {"success": True}) is False
+    assert manager._redis.exists("job:missing", "job:missing:results") == 0
+
+
+def test_add_result_advances_progress(manager):
+    job_id = manager.create_job("video_processing", {"total_items": 2})
+
+    assert manager.add_result(job_id, {"url": "a", "success": True}) is True
+
+    job = manager.get_job(job_id)
+    assert job["progress"] == {"total_items": 2, "completed_items": 1, "percentage": 50.0}
+    assert job["results"] == [{"url": "a", "success": True}]
+    assert 0 < manager._redis.ttl(f"job:{job_id}") <= RedisJobManager.JOB_TTL
+
+
+def test_claim_job_only_once(manager):
+    job_id = manager.create_job("video_processing", {"total_items": 1})
+
+    assert manager.claim_job(job_id) is True
+    assert manager.claim_job(job_id) is False
+    assert manager.get_job(job_id)["status"] == ProcessingStatus.PROCESSING
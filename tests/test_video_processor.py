@@ -0,0 +1,121 @@
+import asyncio
+import json
+import pytest
+from learning_platform import ai, video_processor
+from learning_platform.video_processor import JobProgress, process_single_video
+
+
+class FakeJobManager:
+    def __init__(self):
+        self.results = []
+
+    def add_result(self, job_id, result):
+        self.results.append(result)
+        return True
+
+
+class FakeCache:
+    def __init__(self, values):
+        self.values = values
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Webhooks de progreso enviados (cada envío tarda 50 ms)"""
+    calls = []
+
+    async def fake_send(http, job_manager, job_id, data):
+        await asyncio.sleep(0.05)
+        calls.append(data)
+
+    monkeypatch.setattr(video_processor, "send_progress_webhook", fake_send)
+    monkeypatch.setattr(video_processor, "PROGRESS_WEBHOOK_INTERVAL", 0.1)
+    return calls
+
+
+def done(i):
+    return {"url": f"video-{i}", "success": True}
+
+
+def test_debounce_sends_trailing_flush_without_new_videos(sent):
+    async def run():
+        progress = JobProgress("job", FakeJobManager(), None, 2)
+        await progress.video_done(0, done(0))
+        await progress.video_done(1, done(1))
+        assert len(sent) == 1
+
+        # El segundo video sale al cumplirse el intervalo, sin esperar a otro
+        await asyncio.sleep(0.2)
+        assert [d["current_video"] for d in sent] == [1, 2]
+        await progress.close()
+
+    asyncio.run(run())
+    assert len(sent) == 2
+
+
+def test_close_waits_for_in_flight_delayed_flush(sent):
+    async def run():
+        progress = JobProgress("job", FakeJobManager(), None, 2)
+        await progress.video_done(0, done(0))
+        await progress.video_done(1, done(1))
+
+        # Esperar a que el envío diferido esté con el POST en curso
+        while not progress._scheduled_sending:
+            await asyncio.sleep(0.01)
+        assert len(sent) == 1
+        await progress.close()
+        assert len(sent) == 2
+
+    asyncio.run(run())
+
+
+def test_close_cancels_sleeping_flush_and_sends_pending(sent):
+    async def run():
+        progress = JobProgress("job", FakeJobManager(), None, 2)
+        await progress.video_done(0, done(0))
+        await progress.video_done(1, done(1))
+        await progress.close()
+        assert progress._scheduled is None
+
+    asyncio.run(run())
+    assert [d["current_video"] for d in sent] == [1, 2]
+
+
+def test_cache_hit_skips_pipeline_and_resends_with_current_url(monkeypatch, sent):
+    webhooks = []
+    monkeypatch.setattr(ai, "send_to_webhook", lambda data: webhooks.append(data) or {"status": "success"})
+
+    def fail_download(url):
+        raise AssertionError("no debería descargar en un acierto de caché")
+
+    monkeypatch.setattr(video_processor, "download_audio", fail_download)
+    cached = {
+        "url": "https://www.youtube.com/watch?v=nW-q3Xb8paU",
+        "title": "Video",
+        "video_id": "nW-q3Xb8paU",
+        "summary": "Resumen",
+        "transcript_length": 10,
+        "chunks_processed": 1,
+        "success": True
+    }
+    cache = FakeCache({"yt:nW-q3Xb8paU": json.dumps(cached)})
+    url = "https://youtu.be/nW-q3Xb8paU"
+
+    async def run():
+        progress = JobProgress("job", FakeJobManager(), None, 1)
+        await process_single_video(url, 0, asyncio.Semaphore(1), progress, cache)
+        await progress.close()
+        return progress
+
+    progress = asyncio.run(run())
+    result = progress.results[0]
+    assert result["url"] == url
+    assert result["cached"] is True
+    assert result["webhook_status"] == "success"
+    assert webhooks == [{**{k: cached[k] for k in ai.WEBHOOK_FIELDS}, "url": url}]